@@ -3,15 +3,19 @@ MBFC Scraper - Scrapes media source bias and credibility data
 from mediabiasfactcheck.com across all categories.
 """
 
+import asyncio
 import csv
-import json
+import multiprocessing
 import os
 import random
 import re
-import subprocess
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from bs4 import BeautifulSoup
+import lxml.etree
+import lxml.html
+import orjson
+from curl_cffi.requests import AsyncSession
 
 BASE_URL = "https://mediabiasfactcheck.com"
 
@@ -36,68 +40,165 @@ FIELDNAMES = [
     "credibility",
 ]
 
+# Patterns: "Label: Value" or "Label:Value"
+FIELD_PATTERNS = {
+    key: re.compile(pattern, re.IGNORECASE)
+    for key, pattern in {
+        "bias_rating_raw": r"Bias Rating:\s*(.+)",
+        "factual_reporting_raw": r"Factual Reporting:\s*(.+)",
+        "country": r"Country:\s*(.+)",
+        "freedom_rating": r"Country Freedom Rating:\s*(.+)",
+        "media_type": r"Media Type:\s*(.+)",
+        "traffic": r"Traffic/Popularity:\s*(.+)",
+        "credibility": r"MBFC Credibility Rating:\s*(.+)",
+    }.items()
+}
+RATING_RE = re.compile(r"^(.+?)\s*\(([-\d.]+)\)\s*$")
+SOURCE_RE = re.compile(r"Source:\s*(https?://[^\s]+)")
+# The outlet's own site is linked with its URL as the anchor text; match
+# those anchors (skipping MBFC's internal links) in one compiled XPath call
+SOURCE_LINK_XPATH = lxml.etree.XPath(
+    "//a[@href != '' and @href = normalize-space(.)"
+    " and not(starts-with(@href, $base))]/@href",
+    smart_strings=False,
+)
+
+# Category listings read "Name (domain.tld)". Outlets on these country-code
+# TLDs are never US sources, so their detail pages are not worth fetching.
+# Generic-looking ccTLDs popular with US sites (.co, .io, .tv, .me, .us...)
+# are deliberately left out.
+NON_US_TLDS = (
+    ".uk", ".ie", ".ca", ".au", ".nz", ".za", ".in", ".pk", ".ng", ".ke",
+    ".de", ".fr", ".es", ".it", ".nl", ".be", ".ch", ".at", ".se", ".no",
+    ".dk", ".fi", ".pl", ".pt", ".gr", ".ua", ".ru", ".tr", ".il", ".cn",
+    ".hk", ".tw", ".jp", ".kr", ".sg", ".ph", ".br", ".ar", ".mx",
+)
+LISTING_DOMAIN_RE = re.compile(r"\(([^()\s]+\.[a-z]{2,})\)\s*$", re.IGNORECASE)
+
 OUTPUT_CSV = "mbfc_data.csv"
 OUTPUT_JSON = "mbfc_data.json"
-REQUEST_DELAY = 1  # base seconds between requests (jitter added automatically)
+OUTPUT_JSONL = "mbfc_data.jsonl"  # append-only checkpoint, one record per line
+REQUESTS_PER_SECOND = 3  # average request rate allowed by the rate limiter
 MAX_PER_CATEGORY = None  # set to a number to limit for testing
-
-
-def delay():
-    """Sleep with random jitter to avoid rate limiting."""
-    time.sleep(REQUEST_DELAY + random.uniform(0.5, 2.0))
-
-
-def fetch_url(url, retries=3):
-    """Fetch a URL using curl (avoids TLS fingerprinting issues with Python requests)."""
+INITIAL_CONCURRENCY = 5  # source pages fetched in parallel at start
+MAX_CONCURRENCY = 32  # ceiling for the adaptive concurrency limit
+
+
+class RateLimiter:
+    """Token bucket: allows `requests_per_second` on average, with short bursts."""
+
+    def __init__(self, requests_per_second, burst=None):
+        self.rate = requests_per_second
+        # At least one token, or rates below 1 req/s could never acquire
+        self.capacity = max(1, burst or requests_per_second)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available, then consume it."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveSemaphore:
+    """Semaphore with an AIMD limit: +1 after a run of successes, halved on 429."""
+
+    def __init__(self, initial, maximum, increase_after=50):
+        self.limit = initial
+        self.maximum = maximum
+        self.increase_after = increase_after
+        self.in_use = 0
+        self.successes = 0
+        self.epoch = 0  # bumped on every decrease
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_use < self.limit)
+            self.in_use += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self.condition:
+            self.in_use -= 1
+            # Wake as many waiters as there are free slots (more than one
+            # if the limit was raised since the last release)
+            self.condition.notify(self.limit - self.in_use)
+
+    def record_success(self):
+        """Count a successful response, raising the limit after a long enough run."""
+        self.successes += 1
+        if self.successes >= self.increase_after and self.limit < self.maximum:
+            self.limit += 1
+            self.successes = 0
+
+    def record_throttle(self, epoch):
+        """Halve the limit after a 429; in-flight requests drain naturally."""
+        self.successes = 0
+        # `epoch` is self.epoch as of when the throttled request was sent. A
+        # 429 for a request sent before the last decrease is part of the same
+        # congestion event, so a burst of them halves the limit only once.
+        if epoch != self.epoch:
+            return
+        self.epoch += 1
+        self.limit = max(1, self.limit // 2)
+        print(f"    Concurrency reduced to {self.limit}")
+
+
+rate_limiter = RateLimiter(REQUESTS_PER_SECOND)
+concurrency = AdaptiveSemaphore(INITIAL_CONCURRENCY, MAX_CONCURRENCY)
+
+
+async def fetch_url(client, url, retries=3):
+    """Fetch a URL using curl_cffi (avoids TLS fingerprinting issues with Python HTTP clients)."""
     for attempt in range(retries):
-        result = subprocess.run(
-            ["curl", "-s", "-w", "\n%{http_code}", url],
-            capture_output=True, text=True, timeout=30,
-        )
-        output = result.stdout
-        # Last line is the HTTP status code
-        lines = output.rsplit("\n", 1)
-        if len(lines) == 2:
-            html, status = lines[0], lines[1].strip()
-        else:
-            html, status = output, "0"
-
-        if status == "429":
-            wait = 30 * (attempt + 1)
-            print(f"    Rate limited (429), waiting {wait}s...")
-            time.sleep(wait)
+        await rate_limiter.acquire()
+        epoch = concurrency.epoch
+        resp = await client.get(url)
+        if resp.status_code == 429:
+            concurrency.record_throttle(epoch)
+            # Honor the server's Retry-After (in seconds) when given, otherwise
+            # back off exponentially with jitter so retries don't line up
+            retry_after = resp.headers.get("Retry-After", "").strip()
+            if retry_after.isdigit():
+                wait = int(retry_after)
+            else:
+                wait = min(60, (2 ** attempt) * 2) + random.uniform(0, 1)
+            print(f"    Rate limited (429), waiting {wait:.1f}s...")
+            await asyncio.sleep(wait)
             continue
 
-        if not status.startswith("2"):
-            raise RuntimeError(f"HTTP {status} for {url}")
+        if not 200 <= resp.status_code < 300:
+            raise RuntimeError(f"HTTP {resp.status_code} for {url}")
 
-        return html
+        concurrency.record_success()
+        return resp.text
 
     raise RuntimeError(f"Failed after {retries} retries for {url}")
 
 
-def get_soup(url, retries=3):
-    """Fetch a URL and return a BeautifulSoup object."""
-    html = fetch_url(url, retries=retries)
-    try:
-        return BeautifulSoup(html, "lxml")
-    except Exception:
-        return BeautifulSoup(html, "html.parser")
-
-
-def scrape_category(category_name, path):
+async def scrape_category(client, category_name, path):
     """Scrape a category page and return a list of (name, url) tuples."""
     url = BASE_URL + path
     print(f"  Fetching category: {category_name} ({url})")
-    soup = get_soup(url)
-    table = soup.find("table", {"id": "mbfc-table"})
-    if not table:
+    tree = lxml.html.fromstring(await fetch_url(client, url))
+    table = tree.find('.//table[@id="mbfc-table"]')
+    if table is None:
         print(f"  WARNING: No mbfc-table found for {category_name}")
         return []
 
     sources = []
-    for a in table.find_all("a"):
-        name = a.get_text(strip=True)
+    for a in table.iter("a"):
+        name = a.text_content().strip()
         link = a.get("href")
         if name and link:
             sources.append((name, link))
@@ -106,48 +207,52 @@ def scrape_category(category_name, path):
     return sources
 
 
+def looks_non_us(name):
+    """Guess from a listing's '(domain.tld)' suffix whether the source is non-US."""
+    match = LISTING_DOMAIN_RE.search(name)
+    return bool(match) and match.group(1).lower().endswith(NON_US_TLDS)
+
+
 def parse_rating_field(text):
     """Parse a rating field like 'LEFT (-5.3)' into (label, score)."""
-    match = re.match(r"^(.+?)\s*\(([-\d.]+)\)\s*$", text.strip())
+    match = RATING_RE.match(text.strip())
     if match:
         return match.group(1).strip(), float(match.group(2))
     return text.strip(), None
 
 
-def scrape_source(url):
+async def scrape_source(client, url, parse_pool):
     """Scrape an individual MBFC source page for bias/credibility data."""
-    soup = get_soup(url)
-    content = soup.get_text(separator="\n")
+    html = await fetch_url(client, url)
+    # Parsing is CPU-bound: run it in the process pool so the event loop
+    # keeps driving other fetches meanwhile
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(parse_pool, parse_source_html, html)
+
+
+def parse_source_html(html):
+    """Extract bias/credibility data from the HTML of an MBFC source page."""
+    tree = lxml.html.fromstring(html)
+    # Script/style bodies are not page text; dropping them keeps their
+    # contents out of the field regexes, as BeautifulSoup's get_text did
+    lxml.etree.strip_elements(tree, "script", "style", with_tail=False)
+    # Join text nodes with newlines (like get_text(separator="\n")) so each
+    # "Label: Value" stays on its own line for the field regexes
+    content = "\n".join(tree.itertext())
 
     data = {}
 
     # Extract the actual source website URL from the "Source:" link
-    source_link = None
-    for a in soup.find_all("a"):
-        href = a.get("href", "")
-        text = a.get_text(strip=True)
-        if href and text and href == text and not href.startswith(BASE_URL):
-            source_link = href
-            break
+    links = SOURCE_LINK_XPATH(tree, base=BASE_URL)
+    source_link = links[0] if links else None
     if not source_link:
-        match = re.search(r"Source:\s*(https?://[^\s]+)", content)
+        match = SOURCE_RE.search(content)
         if match:
             source_link = match.group(1).strip()
     data["source_url"] = source_link
 
-    # Patterns: "Label: Value" or "Label:Value"
-    patterns = {
-        "bias_rating_raw": r"Bias Rating:\s*(.+)",
-        "factual_reporting_raw": r"Factual Reporting:\s*(.+)",
-        "country": r"Country:\s*(.+)",
-        "freedom_rating": r"Country Freedom Rating:\s*(.+)",
-        "media_type": r"Media Type:\s*(.+)",
-        "traffic": r"Traffic/Popularity:\s*(.+)",
-        "credibility": r"MBFC Credibility Rating:\s*(.+)",
-    }
-
-    for key, pattern in patterns.items():
-        match = re.search(pattern, content, re.IGNORECASE)
+    for key, pattern in FIELD_PATTERNS.items():
+        match = pattern.search(content)
         if match:
             data[key] = match.group(1).strip()
 
@@ -172,102 +277,216 @@ def scrape_source(url):
     return data
 
 
-def load_existing_results(filepath):
-    """Load already-scraped results from JSON for resume support."""
+def iter_results(filepath):
+    """Stream records from the JSONL checkpoint one line at a time."""
     if not os.path.exists(filepath):
-        return {}
-    try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            records = json.load(f)
-        return {r["url"]: r for r in records}
-    except (json.JSONDecodeError, KeyError):
-        return {}
-
+        return
+    with open(filepath, "rb") as f:
+        for line in f:
+            try:
+                r = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # Skip a line left truncated by an interrupted run
+                continue
+            if "url" in r:
+                yield r
 
-def save_results(results, csv_path, json_path):
-    """Save results to both CSV and JSON."""
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
 
+def load_existing_results(filepath):
+    """Load already-scraped results from the JSONL checkpoint, keyed by URL."""
+    return {r["url"]: r for r in iter_results(filepath)}
+
+
+def load_scraped_urls(filepath):
+    """Collect the URLs already in the JSONL checkpoint for resume support."""
+    return {r["url"] for r in iter_results(filepath)}
+
+
+def seed_checkpoint(json_path, jsonl_path, csv_path):
+    """Start a JSONL checkpoint if none exists, carrying over an older JSON output."""
+    if os.path.exists(jsonl_path):
+        return
+    records = []
+    if os.path.exists(json_path):
+        try:
+            with open(json_path, "rb") as f:
+                records = [r for r in orjson.loads(f.read()) if "url" in r]
+        except (orjson.JSONDecodeError, TypeError):
+            records = []
+    with open(jsonl_path, "wb") as f:
+        for r in records:
+            f.write(orjson.dumps(r) + b"\n")
+
+    # Rebuild the CSV from the same records so the two outputs agree
     with open(csv_path, "w", newline="", encoding="utf-8") as f:
         writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
         writer.writeheader()
-        for row in results:
-            writer.writerow({k: row.get(k, "") for k in FIELDNAMES})
-
-
-def main():
+        for r in records:
+            writer.writerow({k: r.get(k, "") for k in FIELDNAMES})
+
+
+def open_outputs(csv_path, jsonl_path):
+    """Open the CSV and JSONL outputs for appending, writing the CSV header if new."""
+    csv_file = open(csv_path, "a", newline="", encoding="utf-8")
+    if csv_file.tell() == 0:
+        csv.DictWriter(csv_file, fieldnames=FIELDNAMES).writeheader()
+    jsonl_file = open(jsonl_path, "ab+")
+    # Terminate a line left truncated by an interrupted run, so the next
+    # record starts on a fresh line instead of being glued onto it
+    if jsonl_file.tell() > 0:
+        jsonl_file.seek(-1, os.SEEK_END)
+        if jsonl_file.read(1) != b"\n":
+            jsonl_file.write(b"\n")
+    return csv_file, jsonl_file
+
+
+def append_result(data, csv_file, jsonl_file):
+    """Stream a single scraped record to the open JSONL checkpoint and CSV."""
+    jsonl_file.write(orjson.dumps(data) + b"\n")
+    csv.DictWriter(csv_file, fieldnames=FIELDNAMES).writerow(
+        {k: data.get(k, "") for k in FIELDNAMES}
+    )
+    # Flush so an interrupt or crash loses at most the record in flight
+    jsonl_file.flush()
+    csv_file.flush()
+
+
+def save_results(jsonl_path, json_path):
+    """Consolidate the JSONL checkpoint into a single JSON array."""
+    results = list(load_existing_results(jsonl_path).values())
+    # Serialize in one C-level call and hand the file a single write
+    with open(json_path, "wb") as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+
+
+async def main():
     print("MBFC Scraper")
     print("=" * 60)
 
-    # Phase 1: Collect all source links from category pages
-    print("\nPhase 1: Collecting source links from all categories...")
-    all_sources = []  # list of (name, url, category)
-    for category_name, path in CATEGORIES.items():
-        sources = scrape_category(category_name, path)
-        if MAX_PER_CATEGORY:
-            sources = sources[:MAX_PER_CATEGORY]
-        for name, link in sources:
-            all_sources.append((name, link, category_name))
-        time.sleep(3 + random.uniform(1, 2))
-
-    print(f"\nTotal sources found: {len(all_sources)}")
-
-    # Phase 2: Scrape individual MBFC source pages
-    print("\nPhase 2: Scraping MBFC source pages for bias/credibility...")
-    existing = load_existing_results(OUTPUT_JSON)
-    results = list(existing.values())
-    scraped_urls = set(existing.keys())
-
-    skipped = 0
-    errors = 0
-
-    scraped_count = 0
-    try:
-        for i, (name, url, category) in enumerate(all_sources, 1):
+    # One libcurl session for the whole run, impersonating Chrome (TLS
+    # fingerprint, HTTP/2 settings and headers, including User-Agent). Over
+    # HTTP/2 in-flight requests to the MBFC host are multiplexed on a single
+    # connection; libcurl keeps idle connections alive for reuse otherwise.
+    async with AsyncSession(
+        impersonate="chrome",
+        max_clients=MAX_CONCURRENCY,
+        timeout=30,
+    ) as client:
+        # Phase 1: Collect all source links from category pages
+        print("\nPhase 1: Collecting source links from all categories...")
+        # Category pages are fetched concurrently, under the same concurrency
+        # limit as source pages; gather keeps CATEGORIES order
+        async def bound_category(category_name, path):
+            async with concurrency:
+                return await scrape_category(client, category_name, path)
+
+        category_sources = await asyncio.gather(*[
+            bound_category(category_name, path)
+            for category_name, path in CATEGORIES.items()
+        ])
+        all_sources = []  # list of (name, url, category)
+        for category_name, sources in zip(CATEGORIES, category_sources):
+            if MAX_PER_CATEGORY:
+                sources = sources[:MAX_PER_CATEGORY]
+            for name, link in sources:
+                all_sources.append((name, link, category_name))
+
+        # The same outlet is often listed under several categories; keep the
+        # first listing so each source page is fetched only once
+        seen = set()
+        deduped = []
+        for name, link, category_name in all_sources:
+            if link not in seen:
+                seen.add(link)
+                deduped.append((name, link, category_name))
+        duplicates = len(all_sources) - len(deduped)
+
+        # Skip outlets whose domain already rules them out of the US filter
+        all_sources = [src for src in deduped if not looks_non_us(src[0])]
+        non_us = len(deduped) - len(all_sources)
+
+        print(f"\nTotal sources found: {len(all_sources)}")
+        if duplicates:
+            print(f"  Dropped {duplicates} duplicate listings")
+        if non_us:
+            print(f"  Skipped {non_us} sources with non-US domains")
+
+        # Phase 2: Scrape individual MBFC source pages
+        print("\nPhase 2: Scraping MBFC source pages for bias/credibility...")
+        seed_checkpoint(OUTPUT_JSON, OUTPUT_JSONL, OUTPUT_CSV)
+        # Only the URLs are needed to resume; the records stay on disk
+        scraped_urls = load_scraped_urls(OUTPUT_JSONL)
+        saved = len(scraped_urls)
+
+        skipped = 0
+        errors = 0
+
+        async def bound_scrape(i, name, url, category):
+            nonlocal saved, skipped, errors
             if url in scraped_urls:
                 skipped += 1
-                continue
-
-            print(f"  [{i}/{len(all_sources)}] {name}")
-            try:
-                data = scrape_source(url)
-                data["name"] = name
-                data["url"] = url
-                data["category"] = category
-
-                # Filter to US sources only
-                if data.get("country", "").upper() != "USA":
+                return
+
+            async with concurrency:
+                print(f"  [{i}/{len(all_sources)}] {name}")
+                try:
+                    data = await scrape_source(client, url, parse_pool)
+                    data["name"] = name
+                    data["url"] = url
+                    data["category"] = category
+
+                    # Filter to US sources only
+                    if data.get("country", "").upper() != "USA":
+                        scraped_urls.add(url)
+                        return
+
+                    await loop.run_in_executor(
+                        write_pool, append_result, data, csv_file, jsonl_file
+                    )
                     scraped_urls.add(url)
-                    scraped_count += 1
-                    continue
-
-                results.append(data)
-                scraped_urls.add(url)
-            except Exception as e:
-                print(f"    ERROR: {e}")
-                errors += 1
-
-            scraped_count += 1
-
-            # Save progress every 25 sources scraped
-            if scraped_count % 25 == 0:
-                save_results(results, OUTPUT_CSV, OUTPUT_JSON)
-                print(f"  [Progress saved: {len(results)} US sources]")
-
-            delay()
-    except KeyboardInterrupt:
-        print("\n\n  Interrupted! Saving progress...")
-
-    # Final save
-    save_results(results, OUTPUT_CSV, OUTPUT_JSON)
+                    saved += 1
+                except Exception as e:
+                    print(f"    ERROR: {e}")
+                    errors += 1
+
+        csv_file, jsonl_file = open_outputs(OUTPUT_CSV, OUTPUT_JSONL)
+        # Spawn rather than fork: by now the process has other threads (the
+        # writer, asyncio's DNS executor) and asyncio's SIGINT handler, which
+        # a forked child would inherit in an inconsistent state
+        parse_pool = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        # A single writer thread keeps file writes and flushes off the event
+        # loop while still appending records one at a time, in order
+        write_pool = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*[
+                bound_scrape(i, name, url, category)
+                for i, (name, url, category) in enumerate(all_sources, 1)
+            ])
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            print("\n\n  Interrupted! Saving progress...")
+        finally:
+            parse_pool.shutdown(cancel_futures=True)
+            # Let queued writes land before the files are closed
+            write_pool.shutdown(wait=True)
+            csv_file.close()
+            jsonl_file.close()
+
+    # Final save: progress is already on disk, just consolidate the JSON
+    save_results(OUTPUT_JSONL, OUTPUT_JSON)
 
     print("\n" + "=" * 60)
-    print(f"Scraped {len(results)} sources.")
+    print(f"Scraped {saved} sources.")
     print(f"  Skipped (already scraped): {skipped}")
     print(f"  Errors: {errors}")
-    print(f"  Output: {OUTPUT_CSV}, {OUTPUT_JSON}")
+    print(f"  Output: {OUTPUT_CSV}, {OUTPUT_JSON}, {OUTPUT_JSONL}")
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass